@@ -1,16 +1,33 @@
 from flask import Flask, request, jsonify, render_template, session
 import math
+import os
 import random
 import secrets
-from typing import List, Dict, Union, Optional
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Dict, Set, Tuple, Union, Optional
 from datetime import datetime
 
+from config import load_config
+
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)  # Для работы сессий
+app.config.update(load_config())
+# Ключ сессий должен быть общим для всех воркеров и перезапусков. Случайный ключ
+# допустим только для отладки и тестов: production без CALC_SECRET_KEY не запускается
+app.secret_key = app.config['CALC_SECRET_KEY'] or secrets.token_hex(16)
 
 # Хранилище истории вычислений (в памяти)
 calculation_history: List[Dict[str, Union[str, float, None]]] = []
 
+def record_history(entry: Dict[str, Union[str, float, None]]) -> None:
+    """Добавляет запись в историю, удаляя самые старые сверх CALC_HISTORY_CAPACITY"""
+    calculation_history.append(entry)
+    overflow = len(calculation_history) - app.config['CALC_HISTORY_CAPACITY']
+    if overflow > 0:
+        del calculation_history[:overflow]
+
 # Счетчик вычислений в сессии для логики PRO активации
 def get_calculation_count():
     """Возвращает количество вычислений в текущей сессии"""
@@ -18,7 +35,147 @@ def get_calculation_count():
 
 def increment_calculation_count():
     """Увеличивает счетчик вычислений в сессии"""
-    session['calculation_count'] = get_calculation_count() + 1
+    count = get_calculation_count() + 1
+    session['calculation_count'] = count
+    if count == 2:
+        count_pro_activation()
+
+# Число активаций PRO в этом воркере (для /health)
+pro_activations = 0
+_pro_activations_lock = threading.Lock()
+
+def count_pro_activation():
+    """Учитывает активацию PRO версии"""
+    global pro_activations
+    with _pro_activations_lock:
+        pro_activations += 1
+
+class IdempotencyCache:
+    """
+    Ограниченный кэш ответов по заголовку Idempotency-Key.
+    Записи вытесняются по TTL, по количеству и по суммарному размеру
+    в порядке добавления (FIFO): повторное чтение записи не продлевает ее жизнь.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0,
+                 max_bytes: int = 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # ключ -> (срок жизни, отпечаток запроса, тело, статус, размер в байтах)
+        self._entries: 'OrderedDict[str, Tuple[float, Any, bytes, int, int]]' = OrderedDict()
+        self._bytes = 0
+        self._pending: Set[str] = set()  # ключи запросов, которые еще вычисляются
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_size(key: str, fingerprint: Any, body: bytes) -> int:
+        """Память, занимаемая записью: ключ, тело и отпечаток запроса"""
+        size = sys.getsizeof(key) + sys.getsizeof(body) + sys.getsizeof(fingerprint)
+        if isinstance(fingerprint, tuple):
+            size += sum(sys.getsizeof(item) for item in fingerprint)
+        return size
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry[4]
+
+    def _evict_expired(self, now: float) -> None:
+        # Записи упорядочены по времени вставки, поэтому просроченные - в начале
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            expires_at = entry[0]
+            if expires_at > now:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[Tuple[Any, bytes, int]]:
+        """Возвращает (отпечаток запроса, тело, статус) или None"""
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            _, fingerprint, body, status, _ = entry
+            return fingerprint, body, status
+
+    def reserve(self, key: str) -> Tuple[str, Optional[Tuple[Any, bytes, int]]]:
+        """
+        Резервирует ключ перед вычислением. Возвращает ('cached', запись),
+        ('pending', None), если запрос с этим ключом еще выполняется,
+        или ('reserved', None) - тогда вызывающий обязан вызвать put() или release()
+        """
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                _, fingerprint, body, status, _ = entry
+                return 'cached', (fingerprint, body, status)
+            if key in self._pending:
+                return 'pending', None
+            self.misses += 1
+            self._pending.add(key)
+            return 'reserved', None
+
+    def release(self, key: str) -> None:
+        """Снимает резерв без сохранения ответа (вычисление завершилось ошибкой)"""
+        with self._lock:
+            self._pending.discard(key)
+
+    def put(self, key: str, fingerprint: Any, body: bytes, status: int) -> None:
+        """Сохраняет ответ; слишком большие ответы не кэшируются"""
+        size = self._entry_size(key, fingerprint, body)
+        if size > self.max_bytes:
+            self.release(key)
+            return
+        with self._lock:
+            self._pending.discard(key)
+            now = time.monotonic()
+            if key in self._entries:
+                self._drop(key)
+            self._evict_expired(now)
+            while self._entries and (len(self._entries) >= self.max_entries
+                                     or self._bytes + size > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (now + self.ttl_seconds, fingerprint, body, status, size)
+            self._bytes += size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Метрики кэша для /health"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'pending': len(self._pending),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+# Кэш ответов для повторных запросов с одинаковым Idempotency-Key
+idempotency_cache = IdempotencyCache(
+    max_entries=app.config['CALC_IDEMPOTENCY_CACHE_SIZE'],
+    ttl_seconds=app.config['CALC_IDEMPOTENCY_TTL_SECONDS'],
+    max_bytes=app.config['CALC_IDEMPOTENCY_MAX_BYTES'],
+)
 
 def calculate(a: float, b: Optional[float], operation: str) -> float:
     """
@@ -131,7 +288,77 @@ def home():
     # Модалка будет показываться только при первом вычислении через API
     return render_template('index.html', 
                          history=calculation_history[-10:],
-                         show_pro_modal=False)  # Всегда false на главной странице
+                         show_pro_modal=False,  # Всегда false на главной странице
+                         batch_max_size=app.config['CALC_BATCH_MAX_SIZE'])
+
+def parse_operands(data: Dict[str, Any]) -> Tuple[float, Optional[float], Optional[float], str]:
+    """Разбирает параметры вычисления из JSON: (a, b, b для ответа, операция)"""
+    a = float(data.get('a', 0))
+    operation = data.get('operation', 'add')
+    
+    if operation in ['sqrt', 'square', 'cube']:
+        return a, None, None, operation
+    b = float(data.get('b', 0))
+    return a, b, b, operation
+
+def perform_calculation(a: float, b: Optional[float], b_value: Optional[float],
+                        operation: str) -> Dict[str, Any]:
+    """Выполняет вычисление, записывает его в историю и формирует ответ API"""
+    # ВАЖНО: Проверяем ДО вычисления, первое ли это вычисление
+    is_first_calculation = get_calculation_count() == 0
+    
+    # Выполнение вычисления
+    result = calculate(a, b, operation)
+    
+    # Увеличиваем счетчик вычислений в сессии
+    increment_calculation_count()
+    
+    # Формируем запись для истории
+    history_entry = {
+        'a': a,
+        'operation': operation,
+        'display_operation': get_operation_display_name(operation),
+        'result': result,
+        'timestamp': datetime.now().isoformat()
+    }
+    
+    if operation not in ['sqrt', 'square', 'cube']:
+        history_entry['b'] = b_value
+    
+    record_history(history_entry)
+    
+    # Формируем ответ
+    response_data = {
+        'a': a,
+        'operation': operation,
+        'display_operation': get_operation_display_name(operation),
+        'result': result,
+        'history_count': len(calculation_history),
+        'pro_activated': get_calculation_count() >= 2,
+        # КЛЮЧЕВОЕ ИЗМЕНЕНИЕ: сообщаем фронтенду, нужно ли показать модалку
+        'show_pro_modal': is_first_calculation,
+    }
+    
+    # Если нужно показать модалку - добавляем данные для нее
+    if is_first_calculation:
+        response_data['modal_data'] = generate_pro_modal_data()
+    
+    if operation not in ['sqrt', 'square', 'cube']:
+        response_data['b'] = b_value
+    
+    # Запись истории нужна фронтенду, чтобы обновить панель без /api/history
+    response_data['history_entry'] = history_entry
+    return response_data
+
+def describe_calculation_error(e: Exception) -> Tuple[Dict[str, str], int]:
+    """Преобразует ошибку вычисления в тело ответа и HTTP статус"""
+    if isinstance(e, (TypeError, ValueError)):
+        return {'error': f'Неверные параметры: {str(e)}'}, 400
+    if isinstance(e, ZeroDivisionError):
+        return {'error': 'Деление на ноль'}, 400
+    if isinstance(e, OverflowError):
+        return {'error': 'Результат слишком велик'}, 422
+    return {'error': f'Внутренняя ошибка: {str(e)}'}, 500
 
 @app.route('/api/calculate', methods=['GET', 'POST'])
 def api_calculate():
@@ -168,68 +395,76 @@ def api_calculate():
             except Exception:
                 return jsonify({'error': 'Invalid JSON format'}), 400
             
-            a = float(data.get('a', 0))
-            operation = data.get('operation', 'add')
-            
-            if operation in ['sqrt', 'square', 'cube']:
-                b = None
-                b_value = None
-            else:
-                b = float(data.get('b', 0))
-                b_value = b
+            a, b, b_value, operation = parse_operands(data)
         else:
             return jsonify({'error': 'Метод не поддерживается'}), 405
         
-        # ВАЖНО: Проверяем ДО вычисления, первое ли это вычисление
-        is_first_calculation = get_calculation_count() == 0
+        # Повторный запрос с тем же Idempotency-Key отдаем из кэша,
+        # не пересчитывая и не дублируя запись в истории. Ключ генерирует клиент,
+        # поэтому он глобальный и не зависит от cookie: повтор после потерянного
+        # ответа приходит без Set-Cookie первого запроса. Ключ выполняющегося
+        # запроса резервируется, а другие параметры с тем же ключом дают 422
+        idempotency_key = request.headers.get('Idempotency-Key')
+        fingerprint = (operation, repr(a), repr(b_value))
+        if idempotency_key:
+            state, cached = idempotency_cache.reserve(idempotency_key)
+            if state == 'pending':
+                response = jsonify({'error': 'Запрос с этим Idempotency-Key еще выполняется'})
+                response.status_code = 409
+                response.headers['Retry-After'] = '1'
+                return response
+            if state == 'cached':
+                cached_fingerprint, body, status = cached
+                if cached_fingerprint != fingerprint:
+                    return jsonify({'error': 'Idempotency-Key уже использован с другими параметрами'}), 422
+                response = app.response_class(body, status=status, mimetype='application/json')
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
         
-        # Выполнение вычисления
-        result = calculate(a, b, operation)
+        try:
+            response_data = perform_calculation(a, b, b_value, operation)
+        except Exception:
+            if idempotency_key:
+                idempotency_cache.release(idempotency_key)
+            raise
         
-        # Увеличиваем счетчик вычислений в сессии
-        increment_calculation_count()
+        response = jsonify(response_data)
+        if idempotency_key:
+            idempotency_cache.put(idempotency_key, fingerprint, response.get_data(), response.status_code)
+        return response
         
-        # Формируем запись для истории
-        history_entry = {
-            'a': a,
-            'operation': operation,
-            'display_operation': get_operation_display_name(operation),
-            'result': result,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        if operation not in ['sqrt', 'square', 'cube']:
-            history_entry['b'] = b_value
-        
-        calculation_history.append(history_entry)
-        
-        # Формируем ответ
-        response_data = {
-            'a': a,
-            'operation': operation,
-            'display_operation': get_operation_display_name(operation),
-            'result': result,
-            'history_count': len(calculation_history),
-            'pro_activated': get_calculation_count() >= 2,
-            # КЛЮЧЕВОЕ ИЗМЕНЕНИЕ: сообщаем фронтенду, нужно ли показать модалку
-            'show_pro_modal': is_first_calculation,
-        }
-        
-        # Если нужно показать модалку - добавляем данные для нее
-        if is_first_calculation:
-            response_data['modal_data'] = generate_pro_modal_data()
-        
-        if operation not in ['sqrt', 'square', 'cube']:
-            response_data['b'] = b_value
-        
-        return jsonify(response_data)
-        
-    except (TypeError, ValueError) as e:
-        return jsonify({'error': f'Неверные параметры: {str(e)}'}), 400
-    except ZeroDivisionError:
-        return jsonify({'error': 'Деление на ноль'}), 400
     except Exception as e:
-        return jsonify({'error': f'Внутренняя ошибка: {str(e)}'}), 500
+        error, status = describe_calculation_error(e)
+        return jsonify(error), status
+
+@app.route('/api/calculate/batch', methods=['POST'])
+def api_calculate_batch():
+    """
+    Пакетное вычисление: фронтенд объединяет несколько быстрых вводов в один запрос
+    JSON: {"calculations": [{"a": 1, "b": 2, "operation": "add"}, ...]}
+    Ответ: {"results": [...]} - по ответу /api/calculate или {"error", "status"} на каждый элемент
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('calculations'), list):
+        return jsonify({'error': 'Ожидается JSON с полем calculations'}), 400
+    
+    calculations = data['calculations']
+    if len(calculations) > app.config['CALC_BATCH_MAX_SIZE']:
+        return jsonify({'error': f"Не больше {app.config['CALC_BATCH_MAX_SIZE']} вычислений в пакете"}), 400
+    
+    results = []
+    for item in calculations:
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('элемент пакета должен быть объектом')
+            a, b, b_value, operation = parse_operands(item)
+            results.append(perform_calculation(a, b, b_value, operation))
+        except Exception as e:
+            error, status = describe_calculation_error(e)
+            error['status'] = status
+            results.append(error)
+    
+    return jsonify({'results': results, 'history_count': len(calculation_history)})
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
@@ -266,6 +501,8 @@ def get_operations():
 @app.route('/api/activate_pro', methods=['POST'])
 def activate_pro():
     """Активирует PRO версию для пользователя"""
+    if get_calculation_count() < 2:
+        count_pro_activation()
     session['calculation_count'] = 2
     return jsonify({
         'status': 'success',
@@ -279,21 +516,99 @@ def activate_pro():
         'expires': 'Никогда 😉'
     })
 
+class HealthMonitor:
+    """
+    Периодически собирает подробный отчет о состоянии воркера и хранит его
+    уже сериализованным, чтобы частые проверки не вычисляли его заново.
+    Фоновый поток запускается лениво в каждом процессе: потоки мастер-процесса
+    не переживают fork воркеров gunicorn
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        # Время старта процесса: модуль импортируется при запуске, а в воркерах
+        # gunicorn значение обновляется сразу после fork (см. mark_process_start)
+        self._started_at = time.monotonic()
+        self._refreshed_at = 0.0
+        self._body = b''
+
+    def mark_process_start(self) -> None:
+        """Запоминает момент запуска текущего процесса"""
+        self._started_at = time.monotonic()
+
+    def ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.refresh()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.refresh()
+
+    def refresh(self) -> None:
+        """Пересобирает отчет о состоянии"""
+        report = {
+            'status': 'healthy',
+            'service': 'calculator-api',
+            'version': '2.0',
+            'operations_supported': 10,
+            'history_entries': len(calculation_history),
+            'history_capacity': app.config['CALC_HISTORY_CAPACITY'],
+            'pro_users_count': pro_activations,
+            'pro_feature': True,
+            'idempotency_cache': idempotency_cache.stats(),
+            'worker': {
+                'pid': os.getpid(),
+                'uptime_seconds': round(time.monotonic() - self._started_at, 3),
+            },
+            'generated_at': datetime.now().isoformat(),
+            'joke_level': 'maximum'
+        }
+        self._body = app.json.dumps(report).encode('utf-8')
+        self._refreshed_at = time.monotonic()
+
+    def is_ready(self) -> bool:
+        """Воркер готов, пока фоновый поток обновляет отчет"""
+        return time.monotonic() - self._refreshed_at < 3 * self.interval
+
+    def body(self) -> bytes:
+        self.ensure_started()
+        return self._body
+
+health_monitor = HealthMonitor(app.config['CALC_HEALTH_INTERVAL_SECONDS'])
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=health_monitor.mark_process_start)
+
+# Тела ответов проверок сериализуются один раз
+LIVEZ_BODY = b'{"status":"alive"}'
+READY_BODY = b'{"status":"ready"}'
+NOT_READY_BODY = b'{"status":"not ready"}'
+
+@app.route('/livez', methods=['GET'])
+def liveness_check():
+    """Дешевая проверка, что процесс жив: без сессии и вычислений"""
+    return app.response_class(LIVEZ_BODY, mimetype='application/json')
+
+@app.route('/readyz', methods=['GET'])
+def readiness_check():
+    """Проверка готовности воркера принимать запросы"""
+    health_monitor.ensure_started()
+    if health_monitor.is_ready():
+        return app.response_class(READY_BODY, mimetype='application/json')
+    return app.response_class(NOT_READY_BODY, status=503, mimetype='application/json')
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Проверка работоспособности приложения"""
-    pro_users = len([s for s in [session] if s.get('calculation_count', 0) >= 2])
-    
-    return jsonify({
-        'status': 'healthy', 
-        'service': 'calculator-api',
-        'version': '2.0',
-        'operations_supported': 10,
-        'history_entries': len(calculation_history),
-        'pro_users_count': pro_users,
-        'pro_feature': True,
-        'joke_level': 'maximum'
-    })
+    """Подробный отчет о состоянии, обновляемый по таймеру"""
+    return app.response_class(health_monitor.body(), mimetype='application/json')
 
 @app.route('/api/joke', methods=['GET'])
 def get_joke():
@@ -312,8 +627,39 @@ def get_joke():
         'laugh_level': random.randint(7, 10)
     })
 
+def run_production_server() -> None:
+    """
+    Запускает gunicorn с предварительным fork воркеров.
+    preload_app загружает приложение в мастер-процессе, так что секретный ключ
+    сессий и настройки общие для всех воркеров. Данные в памяти (история,
+    кэш идемпотентности) у каждого воркера свои - см. CALC_WORKERS в config.py.
+    Без CALC_SECRET_KEY сервер не запускается: случайный ключ разлогинивал бы
+    все сессии при каждом перезапуске
+    """
+    if not app.config['CALC_SECRET_KEY']:
+        raise SystemExit("Не задан CALC_SECRET_KEY: укажите постоянный ключ сессий "
+                         "или запустите отладочный сервер с CALC_DEBUG=1")
+    
+    from gunicorn.app.base import BaseApplication
+
+    class CalculatorServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{app.config['CALC_HOST']}:{app.config['CALC_PORT']}")
+            self.cfg.set('workers', app.config['CALC_WORKERS'])
+            self.cfg.set('threads', app.config['CALC_THREADS'])
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            return app
+
+    CalculatorServer().run()
+
 def main():
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    if app.config['CALC_DEBUG']:
+        app.run(host=app.config['CALC_HOST'], port=app.config['CALC_PORT'], debug=True)
+    else:
+        run_production_server()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
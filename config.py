@@ -0,0 +1,59 @@
+import os
+from typing import Any, Callable, Dict, Mapping, Optional
+
+# Настройки по умолчанию. Каждую можно переопределить переменной окружения
+# с тем же именем, например CALC_PORT=9000
+DEFAULTS: Dict[str, Any] = {
+    # Сервер
+    'CALC_HOST': '0.0.0.0',
+    'CALC_PORT': 8080,
+    'CALC_DEBUG': False,         # True - отладочный сервер Flask с перезагрузкой
+    # История, кэш идемпотентности и счетчики PRO хранятся в памяти процесса,
+    # поэтому при CALC_WORKERS > 1 у каждого воркера своя копия: /api/history
+    # зависит от воркера, а повтор запроса может не найти сохраненный ответ.
+    # Пока нет общего хранилища, по умолчанию работает один процесс с потоками
+    'CALC_WORKERS': 1,           # число процессов gunicorn в production
+    'CALC_THREADS': 8,           # число потоков в каждом процессе
+    'CALC_SECRET_KEY': None,     # общий ключ сессий; обязателен для production сервера
+    # Хранилище истории
+    'CALC_HISTORY_CAPACITY': 10000,
+    # Кэш идемпотентных ответов
+    'CALC_IDEMPOTENCY_CACHE_SIZE': 1024,
+    'CALC_IDEMPOTENCY_TTL_SECONDS': 300.0,
+    'CALC_IDEMPOTENCY_MAX_BYTES': 1024 * 1024,
+    # Максимальное число вычислений в одном пакетном запросе
+    'CALC_BATCH_MAX_SIZE': 50,
+    # Период обновления подробного отчета /health
+    'CALC_HEALTH_INTERVAL_SECONDS': 5.0,
+}
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _parser_for(default: Any) -> Callable[[str], Any]:
+    if isinstance(default, bool):
+        return _parse_bool
+    if isinstance(default, int):
+        return int
+    if isinstance(default, float):
+        return float
+    return str
+
+def load_config(environ: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    """
+    Собирает настройки приложения из значений по умолчанию и переменных окружения
+    Неверное значение переменной приводит к ValueError с ее именем
+    """
+    if environ is None:
+        environ = os.environ
+
+    config = dict(DEFAULTS)
+    for name, default in DEFAULTS.items():
+        raw = environ.get(name)
+        if raw is None or raw == '':
+            continue
+        try:
+            config[name] = _parser_for(default)(raw)
+        except ValueError:
+            raise ValueError(f"Неверное значение переменной {name}: {raw!r}")
+    return config
@@ -4,10 +4,17 @@ import sys
 import os
 import math 
 import random
+import socket
+import http.client
+import time
+from unittest import mock
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app import app, calculation_history, generate_pro_modal_data
+from app import (app, run_production_server, calculation_history, generate_pro_modal_data, idempotency_cache, IdempotencyCache,
+                 health_monitor)
+from config import DEFAULTS, load_config
+import workload
 
 class CalculatorTests(unittest.TestCase):
 
@@ -17,6 +24,7 @@ class CalculatorTests(unittest.TestCase):
         self.app = app.test_client()
         # Очищаем историю перед каждым тестом
         calculation_history.clear()
+        idempotency_cache.clear()
         # Сбрасываем сессию для каждого теста
         with self.app.session_transaction() as session:
             session.clear()
@@ -461,5 +469,380 @@ class CalculatorTests(unittest.TestCase):
         self.assertTrue(data['pro_activated'])
         self.assertEqual(data['result'], 15.0)
 
+    # Идемпотентность повторных запросов
+    def test_idempotent_retry_returns_cached_response(self):
+        """Тест повторного запроса с тем же Idempotency-Key"""
+        headers = {'Idempotency-Key': 'retry-1'}
+        r1 = self.app.get('/api/calculate?a=2&b=3&operation=add', headers=headers)
+        r2 = self.app.get('/api/calculate?a=2&b=3&operation=add', headers=headers)
+        self.assertEqual(r1.status_code, 200)
+        self.assertEqual(r2.status_code, 200)
+        self.assertEqual(r1.data, r2.data)
+        self.assertEqual(r2.headers.get('Idempotent-Replayed'), 'true')
+        
+        # Запись в истории не дублируется, счетчик сессии не растет
+        self.assertEqual(len(calculation_history), 1)
+        with self.app.session_transaction() as session:
+            self.assertEqual(session.get('calculation_count'), 1)
+
+    def test_idempotency_key_reused_with_other_params(self):
+        """Тест повторного использования ключа с другими параметрами"""
+        headers = {'Idempotency-Key': 'retry-2'}
+        self.app.get('/api/calculate?a=2&b=3&operation=add', headers=headers)
+        r = self.app.get('/api/calculate?a=2&b=4&operation=add', headers=headers)
+        self.assertEqual(r.status_code, 422)
+        self.assertIn('error', r.get_json())
+        self.assertEqual(len(calculation_history), 1)
+
+    def test_idempotency_key_in_progress(self):
+        """Тест повтора, пришедшего пока исходный запрос еще выполняется"""
+        self.assertEqual(idempotency_cache.reserve('busy'), ('reserved', None))
+        
+        r = self.app.get('/api/calculate?a=2&b=3&operation=add', headers={'Idempotency-Key': 'busy'})
+        self.assertEqual(r.status_code, 409)
+        self.assertEqual(r.headers.get('Retry-After'), '1')
+        self.assertEqual(len(calculation_history), 0)
+
+    def test_idempotency_reservation_released_on_error(self):
+        """Тест снятия резерва ключа при ошибке вычисления"""
+        headers = {'Idempotency-Key': 'div'}
+        r = self.app.get('/api/calculate?a=1&b=0&operation=divide', headers=headers)
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(idempotency_cache.stats()['pending'], 0)
+        r = self.app.get('/api/calculate?a=1&b=0&operation=divide', headers=headers)
+        self.assertEqual(r.status_code, 400)
+
+    def test_idempotent_retry_without_cookies(self):
+        """Тест повтора от клиента, который не хранит cookie"""
+        client = app.test_client(use_cookies=False)
+        body = json.dumps({'a': 2, 'b': 3, 'operation': 'add'})
+        headers = {'Idempotency-Key': 'no-cookies'}
+        r1 = client.post('/api/calculate', data=body, content_type='application/json', headers=headers)
+        r2 = client.post('/api/calculate', data=body, content_type='application/json', headers=headers)
+        
+        self.assertEqual(r1.status_code, 200)
+        self.assertEqual(r2.status_code, 200)
+        self.assertEqual(r2.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(r1.data, r2.data)
+        self.assertEqual(len(calculation_history), 1)
+
+    def test_idempotent_retry_after_lost_response(self):
+        """Тест повтора, когда первый ответ (и его Set-Cookie) не дошел до клиента"""
+        headers = {'Idempotency-Key': 'lost'}
+        self.app.get('/api/calculate?a=4&b=5&operation=multiply', headers=headers)
+        # Новый набор cookie: клиент не получил сессию из первого ответа
+        retry_client = app.test_client()
+        r = retry_client.get('/api/calculate?a=4&b=5&operation=multiply', headers=headers)
+        
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(r.get_json()['result'], 20.0)
+        self.assertEqual(len(calculation_history), 1)
+
+    def test_idempotency_cache_bounds(self):
+        """Тест вытеснения записей кэша по количеству, размеру и TTL"""
+        cache = IdempotencyCache(max_entries=2, ttl_seconds=60, max_bytes=1024)
+        cache.put('a', None, b'1', 200)
+        cache.put('b', None, b'2', 200)
+        cache.get('a')  # чтение не продлевает запись: вытеснение FIFO
+        cache.put('c', None, b'3', 200)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        
+        cache.put('big', None, b'x' * 2000, 200)
+        self.assertIsNone(cache.get('big'))
+        self.assertLessEqual(cache.stats()['bytes'], 1024)
+        
+        # Размер учитывает байты ключа, тела и отпечатка запроса
+        sized = IdempotencyCache()
+        fingerprint = ('add', '1.0', '2.0')
+        sized.put('ключ', fingerprint, b'{}', 200)
+        self.assertGreater(sized.stats()['bytes'], len('ключ'.encode('utf-8')) + len(b'{}')
+                           + sum(len(item) for item in fingerprint))
+        sized.clear()
+        self.assertEqual(sized.stats()['bytes'], 0)
+        
+        expired = IdempotencyCache(ttl_seconds=0)
+        expired.put('k', None, b'1', 200)
+        self.assertIsNone(expired.get('k'))
+
+    def test_health_reports_idempotency_cache(self):
+        """Тест метрик кэша идемпотентности в /health"""
+        self.app.get('/api/calculate?a=1&b=1&operation=add', headers={'Idempotency-Key': 'k'})
+        health_monitor.refresh()
+        data = self.app.get('/health').get_json()
+        stats = data['idempotency_cache']
+        self.assertEqual(stats['entries'], 1)
+        self.assertGreater(stats['bytes'], 0)
+        self.assertIn('max_bytes', stats)
+
+    # Переполнение при возведении в степень
+    def test_power_overflow(self):
+        """Тест переполнения при возведении в степень"""
+        r = self.app.get('/api/calculate?a=10&b=400&operation=power')
+        self.assertEqual(r.status_code, 422)
+        self.assertIn('error', r.get_json())
+        self.assertEqual(len(calculation_history), 0)
+
+    def test_huge_float_powers(self):
+        """Тест что огромные степени float сразу дают 422 или 0.0"""
+        r = self.app.get('/api/calculate?a=2&b=1e300&operation=power')
+        self.assertEqual(r.status_code, 422)
+        r = self.app.get('/api/calculate?a=0.5&b=1e9&operation=power')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json()['result'], 0.0)
+
+    # Проверки состояния
+    def test_liveness_check(self):
+        """Тест дешевой проверки живости без сессии"""
+        r = self.app.get('/livez')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json(), {'status': 'alive'})
+        self.assertNotIn('Set-Cookie', r.headers)
+        self.assertNotIn('Cookie', r.headers.get('Vary', ''))
+
+    def test_readiness_check(self):
+        """Тест проверки готовности"""
+        r = self.app.get('/readyz')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json()['status'], 'ready')
+        
+        with mock.patch.object(health_monitor, 'is_ready', return_value=False):
+            r = self.app.get('/readyz')
+        self.assertEqual(r.status_code, 503)
+
+    def test_health_details(self):
+        """Тест подробного отчета о состоянии"""
+        self.app.get('/api/calculate?a=1&b=2&operation=add')
+        health_monitor.refresh()
+        
+        r = self.app.get('/health')
+        self.assertEqual(r.status_code, 200)
+        self.assertNotIn('Set-Cookie', r.headers)
+        data = r.get_json()
+        self.assertEqual(data['history_entries'], 1)
+        self.assertEqual(data['history_capacity'], app.config['CALC_HISTORY_CAPACITY'])
+        self.assertIn('pending', data['idempotency_cache'])
+        self.assertEqual(data['worker']['pid'], os.getpid())
+        self.assertGreaterEqual(data['worker']['uptime_seconds'], 0)
+
+    def test_health_uptime_counts_from_process_start(self):
+        """Тест что время работы считается от запуска процесса, а не от первой проверки"""
+        health_monitor.mark_process_start()
+        time.sleep(0.2)
+        # Первая проверка в процессе запускает монитор заново
+        with mock.patch.object(health_monitor, '_pid', None), \
+                mock.patch('threading.Thread'):
+            data = self.app.get('/health').get_json()
+        self.assertGreaterEqual(data['worker']['uptime_seconds'], 0.2)
+
+    def test_health_is_cached(self):
+        """Тест что отчет не пересчитывается на каждый запрос"""
+        health_monitor.refresh()
+        with mock.patch.object(health_monitor, 'refresh') as refresh:
+            self.app.get('/health')
+            self.app.get('/health')
+        refresh.assert_not_called()
+
+    # Пакетные вычисления
+    def test_calculation_returns_history_entry(self):
+        """Тест записи истории в ответе на вычисление"""
+        r = self.app.get('/api/calculate?a=2&b=3&operation=add')
+        data = r.get_json()
+        self.assertEqual(data['history_entry'], calculation_history[-1])
+
+    def test_batch_calculation(self):
+        """Тест пакетного вычисления"""
+        r = self.app.post('/api/calculate/batch', json={'calculations': [
+            {'a': 2, 'b': 3, 'operation': 'add'},
+            {'a': 5, 'b': 0, 'operation': 'divide'},
+            {'a': 16, 'operation': 'sqrt'},
+        ]})
+        self.assertEqual(r.status_code, 200)
+        data = r.get_json()
+        results = data['results']
+        self.assertEqual(len(results), 3)
+        
+        self.assertEqual(results[0]['result'], 5.0)
+        self.assertTrue(results[0]['show_pro_modal'])
+        self.assertIn('modal_data', results[0])
+        
+        self.assertIn('Деление на ноль', results[1]['error'])
+        self.assertEqual(results[1]['status'], 400)
+        
+        self.assertEqual(results[2]['result'], 4.0)
+        self.assertNotIn('b', results[2])
+        self.assertTrue(results[2]['pro_activated'])
+        
+        self.assertEqual(data['history_count'], 2)
+        self.assertEqual([e['operation'] for e in calculation_history], ['add', 'sqrt'])
+
+    def test_home_page_batch_limit(self):
+        """Тест передачи лимита пакета из настроек в страницу"""
+        with mock.patch.dict(app.config, {'CALC_BATCH_MAX_SIZE': 7}):
+            r = self.app.get('/')
+        self.assertIn(b'const BATCH_MAX_SIZE = 7;', r.data)
+
+    def test_batch_calculation_invalid(self):
+        """Тест некорректных пакетных запросов"""
+        r = self.app.post('/api/calculate/batch', json={'a': 1})
+        self.assertEqual(r.status_code, 400)
+        
+        r = self.app.post('/api/calculate/batch', data='{bad json}', content_type='application/json')
+        self.assertEqual(r.status_code, 400)
+        
+        too_many = [{'a': 1, 'b': 1, 'operation': 'add'}] * (app.config['CALC_BATCH_MAX_SIZE'] + 1)
+        r = self.app.post('/api/calculate/batch', json={'calculations': too_many})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(len(calculation_history), 0)
+        
+        r = self.app.post('/api/calculate/batch', json={'calculations': ['add']})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json()['results'][0]['status'], 400)
+
+    def test_history_capacity(self):
+        """Тест ограничения размера хранилища истории"""
+        with mock.patch.dict(app.config, {'CALC_HISTORY_CAPACITY': 3}):
+            for i in range(5):
+                self.app.get(f'/api/calculate?a={i}&b=1&operation=add')
+        
+        self.assertEqual(len(calculation_history), 3)
+        self.assertEqual(calculation_history[0]['a'], 2.0)
+        self.assertEqual(calculation_history[-1]['a'], 4.0)
+
+class ConfigTests(unittest.TestCase):
+
+    def test_defaults(self):
+        """Тест настроек по умолчанию"""
+        config = load_config({})
+        self.assertEqual(config, DEFAULTS)
+        self.assertFalse(config['CALC_DEBUG'])
+        self.assertIsNone(config['CALC_SECRET_KEY'])
+
+    def test_environment_overrides(self):
+        """Тест переопределения настроек переменными окружения"""
+        config = load_config({
+            'CALC_PORT': '9000',
+            'CALC_DEBUG': 'true',
+            'CALC_WORKERS': '8',
+            'CALC_IDEMPOTENCY_TTL_SECONDS': '0.5',
+            'CALC_SECRET_KEY': 'stable-secret',
+            'CALC_HISTORY_CAPACITY': '',
+        })
+        self.assertEqual(config['CALC_PORT'], 9000)
+        self.assertTrue(config['CALC_DEBUG'])
+        self.assertEqual(config['CALC_WORKERS'], 8)
+        self.assertEqual(config['CALC_IDEMPOTENCY_TTL_SECONDS'], 0.5)
+        self.assertEqual(config['CALC_SECRET_KEY'], 'stable-secret')
+        self.assertEqual(config['CALC_HISTORY_CAPACITY'], DEFAULTS['CALC_HISTORY_CAPACITY'])
+
+    def test_production_requires_secret_key(self):
+        """Тест что production сервер не запускается со случайным ключом сессий"""
+        with mock.patch.dict(app.config, {'CALC_SECRET_KEY': None}):
+            with self.assertRaises(SystemExit) as ctx:
+                run_production_server()
+        self.assertIn('CALC_SECRET_KEY', str(ctx.exception.code))
+
+    def test_invalid_value(self):
+        """Тест неверного значения переменной окружения"""
+        with self.assertRaises(ValueError) as ctx:
+            load_config({'CALC_PORT': 'http'})
+        self.assertIn('CALC_PORT', str(ctx.exception))
+
+class WorkloadTests(unittest.TestCase):
+
+    def setUp(self):
+        calculation_history.clear()
+
+    def test_parse_mix(self):
+        """Тест разбора смеси операций"""
+        self.assertEqual(workload.parse_mix('add=3,sqrt=1'), {'add': 3.0, 'sqrt': 1.0})
+        with self.assertRaises(ValueError):
+            workload.parse_mix('add')
+
+    def test_generate_requests(self):
+        """Тест генерации потока запросов"""
+        mix = {'add': 1, 'sqrt': 1}
+        records = list(workload.generate_requests(200, mix, session_reuse=1.0,
+                                                  pro_modal_hit_rate=1.0, seed=7))
+        self.assertEqual(records, list(workload.generate_requests(200, mix, session_reuse=1.0,
+                                                                  pro_modal_hit_rate=1.0, seed=7)))
+        self.assertEqual(sum(r['kind'] == 'activate_pro' for r in records), 1)
+        records = [r for r in records if r['kind'] == 'calculate']
+        self.assertEqual(len(records), 200)
+        self.assertEqual({r['session'] for r in records}, {'s1'})
+        self.assertEqual({r['operation'] for r in records}, {'add', 'sqrt'})
+        for record in records:
+            self.assertEqual('b' in record, record['operation'] == 'add')
+        
+        # Каждая новая сессия активирует PRO: после первого вычисления, если видит модалку
+        records = list(workload.generate_requests(50, mix, session_reuse=0.0,
+                                                  pro_modal_hit_rate=1.0, seed=7))
+        self.assertEqual(sum(r['kind'] == 'activate_pro' for r in records), 50)
+        self.assertEqual(records[0]['kind'], 'calculate')
+        self.assertEqual(records[1], {'kind': 'activate_pro', 'session': 's1'})
+
+    def test_pro_modal_hit_rate(self):
+        """Тест что число показанных модалок следует заданной доле"""
+        mix = {'add': 1}
+        for rate in (0.0, 0.5, 1.0):
+            calculation_history.clear()
+            records = workload.generate_requests(400, mix, session_reuse=0.0,
+                                                 pro_modal_hit_rate=rate, seed=3)
+            report = workload.run_workload(records, workload.FlaskClientTarget())
+            self.assertAlmostEqual(report['pro_modals_shown'] / 400, rate, delta=0.1)
+
+    def test_replay_jsonl(self):
+        """Тест проигрывания потока через тестовый клиент"""
+        lines = [
+            json.dumps({'kind': 'calculate', 'session': 's1', 'method': 'GET',
+                        'operation': 'add', 'a': 1, 'b': 2}),
+            '',
+            json.dumps({'kind': 'calculate', 'session': 's1', 'method': 'POST',
+                        'operation': 'sqrt', 'a': 9}),
+            json.dumps({'kind': 'activate_pro', 'session': 's2'}),
+        ]
+        report = workload.run_workload(workload.read_requests(lines),
+                                       workload.FlaskClientTarget(), sample_every=1)
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['status_counts'], {200: 3})
+        self.assertEqual(report['pro_modals_shown'], 1)
+        self.assertEqual(report['history_entries'], 2)
+        self.assertEqual(len(report['history_growth']), 3)
+        self.assertGreater(report['history_bytes'], 0)
+        self.assertIn('p99', report['latency_ms'])
+
+    def _http_response(self, status=200, body=b'{"result": 3.0}'):
+        response = mock.Mock(status=status)
+        response.read.return_value = body
+        response.getheader.return_value = None
+        return response
+
+    def test_http_target_reconnects_after_disconnect(self):
+        """Тест повторного подключения, если сервер закрыл соединение"""
+        dropped, fresh = mock.Mock(), mock.Mock()
+        dropped.getresponse.side_effect = http.client.RemoteDisconnected('closed')
+        fresh.getresponse.return_value = self._http_response()
+        with mock.patch('workload.http.client.HTTPConnection', side_effect=[dropped, fresh]):
+            target = workload.HttpTarget('http://127.0.0.1:8080')
+            result = target.send({'kind': 'activate_pro', 'session': 's1'})
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(result['body'], {'result': 3.0})
+        dropped.close.assert_called_once()
+
+    def test_http_target_records_errors(self):
+        """Тест учета сбоев соединения вместо прерывания прогона"""
+        connections = [mock.Mock() for _ in range(4)]
+        connections[0].request.side_effect = ConnectionRefusedError()
+        connections[1].request.side_effect = ConnectionRefusedError()
+        connections[2].getresponse.side_effect = socket.timeout('timed out')
+        connections[3].getresponse.return_value = self._http_response()
+        records = [{'kind': 'activate_pro', 'session': 's1'}] * 3
+        with mock.patch('workload.http.client.HTTPConnection', side_effect=connections):
+            report = workload.run_workload(records, workload.HttpTarget('http://127.0.0.1:8080'))
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['status_counts'], {'error': 2, 200: 1})
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
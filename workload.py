@@ -0,0 +1,310 @@
+"""
+Генератор и проигрыватель нагрузки для калькулятора.
+
+Примеры:
+    python workload.py generate -n 10000 --mix add=50,multiply=20,power=10,sqrt=20 > load.jsonl
+    python workload.py run --input load.jsonl --rate 200
+    python workload.py run -n 5000 --url http://127.0.0.1:8080
+
+Без --url запросы выполняются через тестовый клиент Flask в текущем процессе,
+и тогда дополнительно измеряется рост памяти calculation_history.
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlencode, urlparse
+
+UNARY_OPERATIONS = ['sqrt', 'square', 'cube']
+
+DEFAULT_MIX = 'add=30,subtract=15,multiply=20,divide=15,power=5,root=5,sqrt=5,square=3,cube=2'
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Разбирает строку вида 'add=50,power=10' в словарь весов операций"""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if not name.strip() or not weight:
+            raise ValueError(f"Неверный элемент смеси операций: {part!r}")
+        weights[name.strip()] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise ValueError("Сумма весов операций должна быть положительной")
+    return weights
+
+def draw_operand(rng: random.Random, distribution: str, scale: float) -> float:
+    """Случайный операнд из заданного распределения"""
+    if distribution == 'uniform':
+        return round(rng.uniform(-scale, scale), 4)
+    if distribution == 'int':
+        return float(rng.randint(-int(scale), int(scale)))
+    if distribution == 'lognormal':
+        # Большинство чисел небольшие, но встречаются очень крупные
+        return round(rng.lognormvariate(0, 2) * rng.choice([-1, 1]) * scale / 10, 4)
+    raise ValueError(f"Неизвестное распределение: {distribution}")
+
+def generate_requests(count: int, mix: Dict[str, float], distribution: str = 'uniform',
+                      scale: float = 100.0, session_reuse: float = 0.9,
+                      pro_modal_hit_rate: float = 0.5, post_ratio: float = 0.2,
+                      seed: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Генерирует поток запросов.
+    session_reuse - доля запросов, идущих из уже существующей сессии;
+    pro_modal_hit_rate - доля новых сессий, которые видят PRO модалку на первом
+    вычислении и активируют PRO из нее. Остальные новые сессии - вернувшиеся
+    пользователи, у которых PRO уже активирована, поэтому модалка им не показывается
+    """
+    rng = random.Random(seed)
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    sessions = 0
+
+    for _ in range(count):
+        sees_modal = False
+        if sessions == 0 or rng.random() >= session_reuse:
+            sessions += 1
+            session_id = f's{sessions}'
+            sees_modal = rng.random() < pro_modal_hit_rate
+            if not sees_modal:
+                yield {'kind': 'activate_pro', 'session': session_id}
+        else:
+            session_id = f's{rng.randint(1, sessions)}'
+
+        operation = rng.choices(operations, weights)[0]
+        record = {
+            'kind': 'calculate',
+            'session': session_id,
+            'method': 'POST' if rng.random() < post_ratio else 'GET',
+            'operation': operation,
+            'a': draw_operand(rng, distribution, scale),
+        }
+        if operation == 'power':
+            # Степени держим небольшими, иначе почти все запросы - переполнение
+            record['b'] = float(rng.randint(-5, 10))
+        elif operation == 'root':
+            record['b'] = float(rng.randint(2, 5))
+        elif operation not in UNARY_OPERATIONS:
+            record['b'] = draw_operand(rng, distribution, scale)
+        yield record
+
+        # Как в интерфейсе: модалка появляется после первого вычисления,
+        # и пользователь активирует PRO
+        if sees_modal:
+            yield {'kind': 'activate_pro', 'session': session_id}
+
+def read_requests(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Читает поток запросов из JSONL, пропуская пустые строки"""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+class FlaskClientTarget:
+    """Выполняет запросы через тестовый клиент Flask, по клиенту на сессию"""
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self.clients = {}
+
+    def send(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        client = self.clients.get(record['session'])
+        if client is None:
+            client = self.clients[record['session']] = self.app.test_client()
+        path, method, body = build_request(record)
+        if body is None:
+            response = client.open(path, method=method)
+        else:
+            response = client.open(path, method=method, data=body, content_type='application/json')
+        return {'status': response.status_code, 'body': response.get_json(silent=True)}
+
+class HttpTarget:
+    """
+    Выполняет запросы к запущенному серверу, храня cookie каждой сессии.
+    Если сервер закрыл соединение (например, по keep-alive таймауту), соединение
+    открывается заново и запрос повторяется один раз. Остальные сбои и таймауты
+    учитываются в отчете со статусом 'error'
+    """
+
+    def __init__(self, url: str, timeout: float = 30):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.cookies = {}
+        self._connect()
+
+    def _connect(self) -> None:
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _reconnect(self) -> None:
+        self.conn.close()
+        self._connect()
+
+    def send(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(2):
+            try:
+                return self._send_once(record)
+            except (http.client.RemoteDisconnected, ConnectionError, BrokenPipeError):
+                self._reconnect()
+                if attempt:
+                    break
+            except (OSError, http.client.HTTPException):
+                self._reconnect()
+                break
+        return {'status': 'error', 'body': None}
+
+    def _send_once(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        path, method, body = build_request(record)
+        headers = {}
+        cookie = self.cookies.get(record['session'])
+        if cookie:
+            headers['Cookie'] = cookie
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookies[record['session']] = set_cookie.split(';', 1)[0]
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            payload = None
+        return {'status': response.status, 'body': payload}
+
+def build_request(record: Dict[str, Any]):
+    """Возвращает (путь, метод, тело) HTTP запроса для записи нагрузки"""
+    if record['kind'] == 'activate_pro':
+        return '/api/activate_pro', 'POST', None
+    params = {'a': record['a'], 'operation': record['operation']}
+    if 'b' in record:
+        params['b'] = record['b']
+    if record.get('method') == 'POST':
+        return '/api/calculate', 'POST', json.dumps(params)
+    return '/api/calculate?' + urlencode(params), 'GET', None
+
+def history_memory_bytes(history: List[Dict[str, Any]]) -> int:
+    """Приблизительный объем памяти, занятый записями истории"""
+    total = sys.getsizeof(history)
+    for entry in history:
+        total += sys.getsizeof(entry)
+        for key, value in entry.items():
+            total += sys.getsizeof(key) + sys.getsizeof(value)
+    return total
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+def run_workload(records: Iterable[Dict[str, Any]], target, rate: float = 0.0,
+                 sample_every: int = 1000) -> Dict[str, Any]:
+    """
+    Проигрывает поток запросов с заданной частотой (0 - без ограничения)
+    и возвращает отчет о пропускной способности, задержках и росте истории
+    """
+    history = None
+    if isinstance(target, FlaskClientTarget):
+        from app import calculation_history
+        history = calculation_history
+
+    latencies = []
+    statuses: Dict[Any, int] = {}  # HTTP статус или 'error'
+    modals = 0
+    memory_samples = []
+    started = time.perf_counter()
+
+    for i, record in enumerate(records):
+        if rate > 0:
+            # Открытая модель нагрузки: запрос i отправляется в момент i / rate
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sent = time.perf_counter()
+        result = target.send(record)
+        latencies.append(time.perf_counter() - sent)
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+        if result['body'] and result['body'].get('show_pro_modal'):
+            modals += 1
+        if history is not None and (i + 1) % sample_every == 0:
+            memory_samples.append({
+                'requests': i + 1,
+                'elapsed_seconds': round(time.perf_counter() - started, 3),
+                'history_entries': len(history),
+                'history_bytes': history_memory_bytes(history),
+            })
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    report = {
+        'requests': len(latencies),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            name: round(percentile(latencies, fraction) * 1000, 3)
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+        },
+        'status_counts': statuses,
+        'pro_modals_shown': modals,
+    }
+    if history is not None:
+        report['history_growth'] = memory_samples
+        report['history_entries'] = len(history)
+        report['history_bytes'] = history_memory_bytes(history)
+    return report
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Генератор и проигрыватель нагрузки калькулятора')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_generator_options(p):
+        p.add_argument('-n', '--count', type=int, default=1000, help='число вычислений')
+        p.add_argument('--mix', default=DEFAULT_MIX, help='веса операций: add=50,power=10,...')
+        p.add_argument('--distribution', choices=['uniform', 'int', 'lognormal'], default='uniform')
+        p.add_argument('--scale', type=float, default=100.0, help='масштаб операндов')
+        p.add_argument('--session-reuse', type=float, default=0.9, help='доля запросов из существующих сессий')
+        p.add_argument('--pro-modal-hit-rate', type=float, default=0.5, help='доля новых сессий, видящих PRO модалку')
+        p.add_argument('--post-ratio', type=float, default=0.2, help='доля POST запросов')
+        p.add_argument('--seed', type=int, default=None)
+
+    generate = subparsers.add_parser('generate', help='записать поток запросов в JSONL')
+    add_generator_options(generate)
+    generate.add_argument('-o', '--output', default='-', help='файл JSONL (по умолчанию stdout)')
+
+    run = subparsers.add_parser('run', help='проиграть поток запросов и вывести отчет')
+    add_generator_options(run)
+    run.add_argument('--input', help='файл JSONL для проигрывания вместо генерации')
+    run.add_argument('--url', help='адрес запущенного сервера; без него используется тестовый клиент')
+    run.add_argument('--rate', type=float, default=0.0, help='целевая частота запросов в секунду (0 - максимум)')
+    run.add_argument('--sample-every', type=int, default=1000, help='период замера памяти истории')
+
+    args = parser.parse_args(argv)
+
+    def generated():
+        return generate_requests(args.count, parse_mix(args.mix), args.distribution, args.scale,
+                                 args.session_reuse, args.pro_modal_hit_rate, args.post_ratio, args.seed)
+
+    if args.command == 'generate':
+        out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        try:
+            for record in generated():
+                out.write(json.dumps(record) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return
+
+    target = HttpTarget(args.url) if args.url else FlaskClientTarget()
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            report = run_workload(read_requests(f), target, args.rate, args.sample_every)
+    else:
+        report = run_workload(generated(), target, args.rate, args.sample_every)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()